@@ -11,39 +11,181 @@
 #  - Dynamic ngrok camera URL updates
 # ===============================
 
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-from database import db
+from flask import Flask, render_template, stream_template, request, redirect, url_for, jsonify
+from database import db, set_sqlite_pragmas
+from json_provider import OrjsonProvider
+from sqlalchemy import event, select, text
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime, timedelta, timezone
 from werkzeug.serving import WSGIRequestHandler
+import atexit
+import click
+import hashlib
 import os
+import queue
 import socket
+import threading
+import time
+
+# --------------------------------
+# Logging
+# --------------------------------
+# QueueHandler formats each record on the request thread and puts it on a
+# queue; a background thread does the write to stdout, so a slow log sink
+# never blocks a request.
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
+log_listener = QueueListener(log_queue, log_output)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+root_logger = logging.getLogger()
+root_logger.addHandler(QueueHandler(log_queue))
+root_logger.setLevel(logging.INFO)
+
+logger = logging.getLogger(__name__)
 
 # --------------------------------
 # App Configuration
 # --------------------------------
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # DATABASE_URL (Render will inject automatically)
 # Fallback to local SQLite for testing
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///feeder.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Keep DB connections open and reuse them across requests, so the Pi's
+# frequent polls don't pay a fresh PostgreSQL connect/TLS/auth each time.
+#  - pool_pre_ping: drop connections the server closed while idle
+#  - pool_recycle: replace connections older than 30 min
+#  - query_cache_size: room for every compiled statement the app issues
+engine_options = {
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    'query_cache_size': 1200,
+}
+# QueuePool sizing; in-memory SQLite (sqlite://) uses a StaticPool,
+# which rejects these arguments.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    engine_options.update(pool_size=10, max_overflow=20, pool_timeout=5)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
 # Initialize SQLAlchemy
 db.init_app(app)
 
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
 # Import models (after db.init_app to avoid circular imports)
 from models import Schedule, FeedLog, SensorData, Command
 
-# Create tables if missing
-with app.app_context():
+
+# --------------------------------
+# 🗄️ Database setup (run once per deploy: `flask --app app init-db`)
+# --------------------------------
+# Kept out of import time so gunicorn workers don't each run
+# CREATE TABLE checks on boot.
+def init_db():
+    # Create tables if missing
     db.create_all()
+    # create_all() skips tables that already exist, so add indexes
+    # introduced later (e.g. on timestamp columns) separately.
+    for model in (FeedLog, SensorData):
+        for index in model.__table__.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create missing tables and indexes."""
+    init_db()
+    click.echo("Database initialized.")
+
+# --------------------------------
+# 🧠 Command queue helper
+# --------------------------------
+# PostgreSQL channel the Pi can LISTEN on instead of polling
+COMMAND_CHANNEL = 'pet_feeder'
+
+# The command table stays the durable queue, but most Pi polls find it empty.
+# Every enqueue bumps 'version'; a poll that confirms the table is empty
+# records the version it started from in 'empty_at'. Until the next enqueue,
+# or for at most COMMAND_EMPTY_TTL seconds, polls answer 'none' without
+# touching the DB. The TTL bounds how long commands inserted outside this
+# process (another instance, a manual INSERT) can go unnoticed.
+COMMAND_EMPTY_TTL = 5.0
+command_lock = threading.Lock()
+command_state = {'version': 0, 'empty_at': None, 'empty_until': 0.0}
+
+
+def enqueue_command(command):
+    """Queue a command for the Pi client (plain INSERT, no ORM object)."""
+    db.session.execute(Command.__table__.insert().values(command=command))
+    db.session.commit()
+    # Bump only after the row is committed, so a concurrent poll can't mark
+    # it as gone, and before notifying, so a Pi woken by the NOTIFY can't
+    # hit the empty-queue shortcut.
+    with command_lock:
+        command_state['version'] += 1
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :command)"),
+            {'channel': COMMAND_CHANNEL, 'command': command},
+        )
+        db.session.commit()
+
 
 # --------------------------------
 # 🔗 Store current ngrok link (updated by Pi)
 # --------------------------------
 current_ngrok_url = None
 
+# --------------------------------
+# 📡 Latest sensor reading (updated by /api/update_level)
+# --------------------------------
+# Lets the dashboard skip the ORDER BY timestamp DESC query on every load.
+# After a restart the first dashboard load merges in the newest DB row
+# ('loaded'); until then update_level may already have stored a reading.
+# All reads and writes hold sensor_lock and keep whichever reading is newest.
+sensor_lock = threading.Lock()
+latest_sensor_cache = {'level': None, 'timestamp': None, 'loaded': False}
+
+
+def remember_sensor_reading(level, timestamp):
+    """Store a reading unless the cache already holds a newer one."""
+    with sensor_lock:
+        cached_ts = latest_sensor_cache['timestamp']
+        if cached_ts is None or timestamp >= cached_ts:
+            latest_sensor_cache.update(level=level, timestamp=timestamp)
+
+
+def get_latest_sensor():
+    """Copy of the newest reading ({'level', 'timestamp'}), or None."""
+    with sensor_lock:
+        loaded = latest_sensor_cache['loaded']
+    if not loaded:
+        row = db.session.execute(
+            select(SensorData.level, SensorData.timestamp)
+            .order_by(SensorData.timestamp.desc())
+            .limit(1)
+        ).first()
+        if row is not None:
+            remember_sensor_reading(row.level, row.timestamp)
+        with sensor_lock:
+            latest_sensor_cache['loaded'] = True
+    with sensor_lock:
+        if latest_sensor_cache['timestamp'] is None:
+            return None
+        return {
+            'level': latest_sensor_cache['level'],
+            'timestamp': latest_sensor_cache['timestamp'],
+        }
+
 
 # --------------------------------
 # 🏠 Dashboard
@@ -51,8 +193,7 @@ current_ngrok_url = None
 @app.route('/')
 def index():
     schedules = Schedule.query.all()
-    latest_sensor = SensorData.query.order_by(SensorData.timestamp.desc()).first()
-    return render_template('index.html', schedules=schedules, sensor=latest_sensor)
+    return render_template('index.html', schedules=schedules, sensor=get_latest_sensor())
 
 
 # --------------------------------
@@ -61,11 +202,18 @@ def index():
 @app.route('/schedule', methods=['GET', 'POST'])
 def schedule():
     if request.method == 'POST':
-        time_str = request.form['time']
-        portion = request.form['portion']
-        new_schedule = Schedule(time=time_str, portion=portion)
-        db.session.add(new_schedule)
-        db.session.commit()
+        # The form may submit several time/portion rows at once;
+        # store them with a single multi-row INSERT.
+        rows = [
+            {'time': time_str, 'portion': portion}
+            for time_str, portion in zip(
+                request.form.getlist('time'), request.form.getlist('portion')
+            )
+        ]
+        if rows:
+            db.session.execute(Schedule.__table__.insert(), rows)
+            db.session.commit()
+            invalidate_schedule_cache()
         return redirect(url_for('schedule'))
     schedules = Schedule.query.all()
     return render_template('schedule.html', schedules=schedules)
@@ -76,24 +224,68 @@ def delete_schedule(id):
     s = Schedule.query.get_or_404(id)
     db.session.delete(s)
     db.session.commit()
+    invalidate_schedule_cache()
     return redirect(url_for('schedule'))
 
 # --------------------------------
 # 🗓️ API: schedule fetch for Pi client
 # --------------------------------
+# (JSON body, ETag) pair, rebuilt after any schedule change.
+# Every invalidation bumps the generation; a rebuild only stores its body if
+# no schedule change committed since it started, so a slow rebuild can't
+# put back a schedule that is already out of date.
+schedule_lock = threading.Lock()
+schedule_json_cache = None
+schedule_generation = 0
+
+# PostgreSQL builds the whole JSON array itself, no Python rows at all.
+# Cast to text, otherwise psycopg2 decodes the json back into Python lists.
+SCHEDULE_JSON_SQL = text(
+    "SELECT COALESCE(json_agg(json_build_object("
+    "'time', time, 'portion', portion)), '[]'::json)::text FROM schedule"
+)
+
+
+def invalidate_schedule_cache():
+    global schedule_json_cache, schedule_generation
+    with schedule_lock:
+        schedule_generation += 1
+        schedule_json_cache = None
+
+
 @app.route('/api/get_schedule', methods=['GET'])
 def get_schedule():
-    schedules = Schedule.query.all()
-    schedule_list = [{"time": s.time, "portion": s.portion} for s in schedules]
-    return jsonify({"schedule": schedule_list})
+    """Pi may send If-None-Match with the last ETag and get an empty 304 back."""
+    global schedule_json_cache
+    with schedule_lock:
+        cached = schedule_json_cache
+        generation = schedule_generation
+    if cached is None:
+        if db.engine.dialect.name == 'postgresql':
+            schedule_json = db.session.execute(SCHEDULE_JSON_SQL).scalar()
+            body = f'{{"schedule":{schedule_json}}}'.encode()
+        else:
+            rows = db.session.execute(select(Schedule.time, Schedule.portion)).all()
+            schedule_list = [{"time": r.time, "portion": r.portion} for r in rows]
+            body = jsonify({"schedule": schedule_list}).get_data()
+        cached = (body, hashlib.md5(body).hexdigest())
+        with schedule_lock:
+            if schedule_generation == generation:
+                schedule_json_cache = cached
+    body, etag = cached
+    resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    return resp.make_conditional(request)
 
 # --------------------------------
 # 📜 Feeding logs
 # --------------------------------
+# Rows are fetched 500 at a time (server-side cursor on PostgreSQL) and the
+# page is streamed as it renders, so memory doesn't grow with the log count.
 @app.route('/logs')
 def logs():
-    logs = FeedLog.query.order_by(FeedLog.timestamp.desc()).all()
-    return render_template('logs.html', logs=logs)
+    logs = FeedLog.query.order_by(FeedLog.timestamp.desc()).yield_per(500)
+    return stream_template('logs.html', logs=logs)
 
 
 # --------------------------------
@@ -108,8 +300,7 @@ def sensors():
 # --------------------------------
 # 🎥 Camera control + ngrok integration
 # --------------------------------
-@app.route('/camera')
-def camera():
+def detect_local_ip():
     # Try to get local Pi IP (for LAN fallback)
     try:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -118,9 +309,17 @@ def camera():
         s.close()
     except Exception:
         local_ip = "127.0.0.1"
+    return local_ip
 
+
+# The LAN address doesn't change while the app runs, so look it up once.
+LOCAL_IP = detect_local_ip()
+
+
+@app.route('/camera')
+def camera():
     # Default local stream (if ngrok not yet reported)
-    fallback_url = f"http://{local_ip}:8080/?action=stream"
+    fallback_url = f"http://{LOCAL_IP}:8080/?action=stream"
     stream_url = current_ngrok_url or fallback_url
 
     return render_template('camera.html', title="Camera", stream_url=stream_url)
@@ -128,16 +327,12 @@ def camera():
 # ---------------- Camera on/off API ----------------
 @app.route('/api/camera/on', methods=['POST'])
 def camera_on():
-    cmd = Command(command="camera_on")
-    db.session.add(cmd)
-    db.session.commit()
+    enqueue_command("camera_on")
     return jsonify({"status": "ok", "message": "Camera ON command sent"}), 200
 
 @app.route('/api/camera/off', methods=['POST'])
 def camera_off():
-    cmd = Command(command="camera_off")
-    db.session.add(cmd)
-    db.session.commit()
+    enqueue_command("camera_off")
     return jsonify({"status": "ok", "message": "Camera OFF command sent"}), 200
 
 # ---------- 🧠 API: ngrok updates ----------
@@ -149,7 +344,7 @@ def update_ngrok():
     if not data or "url" not in data:
         return jsonify({"error": "Missing 'url'"}), 400
     current_ngrok_url = data["url"]
-    print(f"[INFO] Updated ngrok URL: {current_ngrok_url}")
+    logger.info("Updated ngrok URL: %s", current_ngrok_url)
     return jsonify({"status": "ok"}), 200
 
 
@@ -160,33 +355,146 @@ def get_ngrok():
 
 
 # ---------- 🧠 API: Pi Client ----------
+# Pop the oldest command in a single statement. A row can only be deleted
+# (and returned) once, so two pollers never receive the same command.
+# On PostgreSQL the subquery locks its row and skips rows another poll has
+# locked; without SKIP LOCKED an overlapping poll would wait for the other
+# DELETE, find its row gone and return nothing while commands are queued.
+# SQLite serializes writers, so the plain subquery is enough there.
+POP_COMMAND_SQL = text(
+    "DELETE FROM command WHERE id = "
+    "(SELECT id FROM command ORDER BY id ASC LIMIT 1) "
+    "RETURNING command"
+)
+POP_COMMAND_PG_SQL = text(
+    "DELETE FROM command WHERE id = "
+    "(SELECT id FROM command ORDER BY id ASC LIMIT 1 FOR UPDATE SKIP LOCKED) "
+    "RETURNING command"
+)
+
+COMMAND_EXISTS_SQL = text("SELECT EXISTS (SELECT 1 FROM command)")
+
+
+def pop_command():
+    """Remove and return the oldest queued command, or None if there is none."""
+    if db.engine.dialect.delete_returning:
+        if db.engine.dialect.name == 'postgresql':
+            row = db.session.execute(POP_COMMAND_PG_SQL).fetchone()
+        else:
+            row = db.session.execute(POP_COMMAND_SQL).fetchone()
+        db.session.commit()
+        return row[0] if row else None
+
+    # Fallback for SQLite builds without RETURNING (< 3.35):
+    # only the poller whose DELETE actually removed the row gets the command.
+    while True:
+        row = db.session.execute(
+            text("SELECT id, command FROM command ORDER BY id ASC LIMIT 1")
+        ).fetchone()
+        if row is None:
+            return None
+        deleted = db.session.execute(
+            text("DELETE FROM command WHERE id = :id"), {'id': row.id}
+        ).rowcount
+        db.session.commit()
+        if deleted:
+            return row.command
+
+
 @app.route('/api/get_command')
 def get_command():
-    cmd = Command.query.order_by(Command.id.asc()).first()
-    if cmd:
-        command_text = cmd.command
-        db.session.delete(cmd)
+    with command_lock:
+        if (command_state['empty_at'] == command_state['version']
+                and time.monotonic() < command_state['empty_until']):
+            return jsonify({'command': 'none'})
+        version = command_state['version']
+
+    command = pop_command()
+    if command is None:
+        # An overlapping poll can also come back empty-handed, so only cache
+        # "empty" once the table really has no rows.
+        if not db.session.execute(COMMAND_EXISTS_SQL).scalar():
+            with command_lock:
+                if command_state['version'] == version:
+                    command_state['empty_at'] = version
+                    command_state['empty_until'] = time.monotonic() + COMMAND_EMPTY_TTL
         db.session.commit()
-        return jsonify({'command': command_text})
-    return jsonify({'command': 'none'})
+        return jsonify({'command': 'none'})
+    return jsonify({'command': command})
 
 
 @app.route('/api/upload_log', methods=['POST'])
 def upload_log():
     data = request.json
-    new_log = FeedLog(amount=data.get('amount'), result=data.get('result'))
-    db.session.add(new_log)
+    db.session.execute(
+        FeedLog.__table__.insert().values(
+            amount=data.get('amount'), result=data.get('result')
+        )
+    )
     db.session.commit()
     return jsonify({'status': 'log_saved'})
 
 
+def parse_sample_time(ts):
+    """
+    Sample timestamp from the Pi: unix seconds or ISO-8601.
+    Returned as naive UTC, like the rest of the timestamp columns.
+    Raises ValueError/TypeError on anything else.
+    """
+    if ts is None:
+        return datetime.utcnow()
+    if isinstance(ts, bool):
+        raise TypeError("ts must be a number or an ISO-8601 string")
+    if isinstance(ts, (int, float)):
+        return datetime.utcfromtimestamp(ts)
+    if not isinstance(ts, str):
+        raise TypeError("ts must be a number or an ISO-8601 string")
+    if ts.endswith('Z'):
+        ts = ts[:-1] + '+00:00'   # fromisoformat() only accepts 'Z' on 3.11+
+    parsed = datetime.fromisoformat(ts)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_sample(sample):
+    """Validate one {level, ts} reading and turn it into a sensor_data row."""
+    if not isinstance(sample, dict):
+        raise TypeError("each sample must be an object")
+    level = sample.get('level')
+    return {
+        'level': float(level) if level is not None else None,
+        'timestamp': parse_sample_time(sample.get('ts')),
+    }
+
+
 @app.route('/api/update_level', methods=['POST'])
 def update_level():
+    """
+    Accepts either a single reading  {"level": 42}
+    or a buffered batch              {"samples": [{"level": 42, "ts": 1700000000}, ...]}
+    A batch is written with one multi-row INSERT and one commit.
+    The whole request is validated first, so bad input stores nothing.
+    """
     data = request.json
-    new_data = SensorData(level=data.get('level'))
-    db.session.add(new_data)
-    db.session.commit()
-    return jsonify({'status': 'level_updated'})
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    samples = data.get('samples')
+    if samples is None:
+        samples = [{'level': data.get('level')}]
+    if not isinstance(samples, list):
+        return jsonify({'error': "'samples' must be a list"}), 400
+    try:
+        rows = [parse_sample(s) for s in samples]
+    except (TypeError, ValueError, OverflowError, OSError) as e:
+        return jsonify({'error': f'Invalid sample: {e}'}), 400
+
+    if rows:
+        db.session.execute(SensorData.__table__.insert(), rows)
+        db.session.commit()
+        newest = max(rows, key=lambda r: r['timestamp'])
+        remember_sensor_reading(newest['level'], newest['timestamp'])
+    return jsonify({'status': 'level_updated', 'count': len(rows)})
 
 
 # --------------------------------
@@ -195,9 +503,7 @@ def update_level():
 @app.route('/feed_now', methods=['POST'])
 def feed_now():
     portion = request.form['portion']
-    cmd = Command(command=f'feed:{portion}')
-    db.session.add(cmd)
-    db.session.commit()
+    enqueue_command(f'feed:{portion}')
     return redirect(url_for('index'))
 
 # --------------------------------
@@ -214,5 +520,7 @@ class TZRequestHandler(WSGIRequestHandler):
 # 🚀 Run locally
 # --------------------------------
 if __name__ == '__main__':
+    with app.app_context():
+        init_db()
     WSGIRequestHandler = TZRequestHandler
     app.run(debug=True)
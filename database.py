@@ -1,2 +1,15 @@
 from flask_sqlalchemy import SQLAlchemy
+
 db = SQLAlchemy()
+
+
+# SQLite fallback (local testing): WAL lets readers run while the Pi writes,
+# synchronous=NORMAL drops the fsync on every commit (safe with WAL).
+# Registered on the app's engine in app.py, only when it is SQLite.
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
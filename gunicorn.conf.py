@@ -0,0 +1,20 @@
+# ===============================
+# gunicorn.conf.py
+# ===============================
+# Picked up automatically by `gunicorn app:app` (Procfile / render.yaml).
+#
+# The Pi polls the API often and every handler mostly waits on the
+# remote PostgreSQL database, so one worker process serves requests on
+# several threads: while one thread waits for the DB, others keep going.
+#
+# Keep a single worker: the app holds in-process caches (latest sensor
+# reading, schedule JSON) that are only coherent within one process.
+# Threads share the SQLAlchemy pool, so keep threads <= pool_size in app.py.
+# ===============================
+
+import os
+
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = 30
@@ -0,0 +1,69 @@
+# ===============================
+# json_provider.py
+# ===============================
+# Flask JSON provider backed by orjson (C implementation).
+# Used for request.get_json() / request.json parsing and
+# jsonify() responses on the Pi-facing API.
+# ===============================
+
+import decimal
+
+import orjson
+from flask.json.provider import JSONProvider
+
+
+def _default(o):
+    # orjson already handles datetime, date, UUID and dataclasses
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Differences from Flask's DefaultJSONProvider:
+     - keys keep insertion order unless sort_keys is set (the default
+       provider sorts them); pass sort_keys=True or set the attribute
+     - output is always UTF-8, ensure_ascii is not supported
+     - dates serialize as ISO-8601, not HTTP dates
+     - other json.dumps kwargs (indent, separators, ...) are ignored
+    Non-str dict keys (e.g. ints) are converted to strings, like json.dumps.
+    """
+
+    sort_keys = False
+
+    def _option(self, sort_keys):
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def _dumps_bytes(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=kwargs.get("default", _default),
+            option=self._option(kwargs.get("sort_keys", self.sort_keys)),
+        )
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj, **kwargs).decode()
+
+    def loads(self, s, **kwargs):
+        # Malformed input raises orjson.JSONDecodeError (a ValueError),
+        # which Flask turns into a 400 Bad Request.
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Same argument rules as jsonify(); hand orjson's bytes straight
+        # to the response, no str round trip.
+        if args and kwargs:
+            raise TypeError("jsonify() takes either args or kwargs, not both")
+        if len(args) == 1:
+            obj = args[0]
+        else:
+            obj = args or kwargs or None
+        return self._app.response_class(
+            self._dumps_bytes(obj), mimetype="application/json"
+        )
@@ -41,7 +41,7 @@ class FeedLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float)                  # actual food dispensed (grams)
     result = db.Column(db.String(50))             # e.g. "success", "jammed", "manual"
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # /logs sorts by this
 
     def __repr__(self):
         return f"<FeedLog {self.amount}g @ {self.timestamp}>"
@@ -59,7 +59,7 @@ class SensorData(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     level = db.Column(db.Float)                   # remaining food (%) or raw distance
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # newest-first reads
 
     def __repr__(self):
         return f"<SensorData {self.level}% @ {self.timestamp}>"
@@ -78,6 +78,11 @@ class Command(db.Model):
       - 'camera_off'
     Raspberry Pi periodically calls /api/get_command to check for new commands.
     After a command is read, it’s deleted from the database.
+    On PostgreSQL every new command also sends NOTIFY on the 'pet_feeder'
+    channel, so a Pi that LISTENs can call /api/get_command right away
+    and poll only rarely as a fallback.
+    No extra index needed: the Pi always takes the lowest id,
+    which is a primary-key lookup.
     """
     id = db.Column(db.Integer, primary_key=True)
     command = db.Column(db.String(50))